@@ -1,10 +1,19 @@
 import os
 import gzip
 import re
-import xml.etree.ElementTree as ET
+import html
+import codecs
+import lxml.etree as ET
 import requests
+from requests.adapters import HTTPAdapter
+from isal import igzip, isal_zlib
+import xxhash
 from datetime import datetime, timedelta
 import time
+import json
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 days_future = 0
@@ -13,50 +22,61 @@ skip_dummy_programs = False
 
 max_retries = 5
 retry_delay = 5
+download_workers = 4
 
 tvg_ids_file = os.path.join(os.path.dirname(__file__), 'tvg-ids.txt')
 output_file_gz = os.path.join(os.path.dirname(__file__), 'epg.xml.gz')
+# Downloaded sources are kept here so the next run can revalidate them with a
+# conditional request, and fall back to them when a download fails. This only
+# helps where the directory survives between runs (local or self-hosted). The
+# GitHub workflow starts on a fresh runner, so there every source is downloaded
+# in full on every run
+cache_dir = os.path.join(os.path.dirname(__file__), '.epg-cache')
 
-def fix_xml_issues(xml_content):
-    """Fix common XML encoding and formatting issues for player compatibility"""
-    xml_content = xml_content.replace('&amp;amp;', '&amp;')
-    xml_content = re.sub(r'</programme>\s*<programme', '</programme>\n<programme', xml_content)
-    xml_content = re.sub(r'[^\x20-\x7E\n\r\t]', '', xml_content)
-    return xml_content
+# One pooled session so connections to the same host are reused across sources
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=0))
+session.mount('http://', HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=0))
 
-def parse_xmltv_time(time_str):
-    """Parse XMLTV time format (YYYYMMDDHHmmss +TZOFFSET) to datetime"""
-    if not time_str:
-        return None
-    try:
-        date_part = time_str[:14]
-        return datetime.strptime(date_part, '%Y%m%d%H%M%S')
-    except:
-        return None
+read_chunk_size = 1024 * 1024
+max_record_size = 4 * 1024 * 1024
+write_batch_size = 1000
 
-def is_programme_too_far_future(start_time_str, days_limit):
-    """Check if a programme starts more than X days in the future"""
-    if not days_limit or days_limit <= 0:
-        return False
+# Record start tags, plus comments and CDATA sections which have to be stepped over
+# because they may contain text that looks like a record tag
+_RECORD_OPEN_RE = re.compile(rb'<(channel|programme)[\s/>]|<!(--|\[CDATA\[)')
+_MARKUP_END = {b'--': b'-->', b'[CDATA[': b']]>'}
+_RECORD_ATTR_RE = re.compile(rb'\s(id|channel|start|stop)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+_XML_ENCODING_RE = re.compile(rb'<\?xml[^>]*encoding\s*=\s*["\']([\w.:-]+)["\']')
+# A playlist tvg-id value ends at its closing quote, or is cut off by a line break
+_TVG_ID_END_RE = re.compile(rb'["\r\n]')
+
+def get_time_cutoffs():
+    """Return (future_cutoff, past_cutoff) as XMLTV YYYYMMDDHHmmss strings, None for disabled filters"""
+    now = datetime.now()
+    future_cutoff = None
+    past_cutoff = None
     
-    start_time = parse_xmltv_time(start_time_str)
-    if not start_time:
-        return False
+    if days_future and days_future > 0:
+        future_cutoff = (now + timedelta(days=days_future)).strftime('%Y%m%d%H%M%S')
+    if days_past and days_past > 0:
+        past_cutoff = (now - timedelta(days=days_past)).strftime('%Y%m%d%H%M%S')
     
-    future_cutoff = datetime.now() + timedelta(days=days_limit)
-    return start_time > future_cutoff
+    return future_cutoff, past_cutoff
 
-def is_programme_too_far_past(stop_time_str, days_limit):
-    """Check if a programme ended more than X days ago"""
-    if not days_limit or days_limit <= 0:
+# XMLTV times (YYYYMMDDHHmmss +TZOFFSET) sort as plain strings, so the 14 digit
+# prefix is compared against the cutoff directly. Like before, the offset is ignored.
+def is_programme_too_far_future(start_time_str, future_cutoff):
+    """Check if a programme starts after the future cutoff"""
+    if future_cutoff is None or not start_time_str:
         return False
-    
-    stop_time = parse_xmltv_time(stop_time_str)
-    if not stop_time:
+    return start_time_str[:14] > future_cutoff
+
+def is_programme_too_far_past(stop_time_str, past_cutoff):
+    """Check if a programme ended before the past cutoff"""
+    if past_cutoff is None or not stop_time_str:
         return False
-    
-    past_cutoff = datetime.now() - timedelta(days=days_limit)
-    return stop_time < past_cutoff
+    return stop_time_str[:14] < past_cutoff
 
 def is_dummy_programme(tvg_id):
     """Check if programme has 'dummy' in its tvg-id (case insensitive)"""
@@ -68,32 +88,32 @@ def is_dummy_programme(tvg_id):
     
     return 'dummy' in tvg_id.lower()
 
-def fetch_with_retry(url, timeout=30):
-    """Fetch URL with retry logic"""
+def fetch_with_retry(url, timeout=30, headers=None, log=print):
+    """Fetch URL with retry logic, 304 counts as success for conditional requests"""
     for attempt in range(1, max_retries + 1):
         try:
-            print(f"  Fetching {url}... (attempt {attempt}/{max_retries})")
-            response = requests.get(url, timeout=timeout, stream=True)
+            log(f"  Fetching {url}... (attempt {attempt}/{max_retries})")
+            response = session.get(url, timeout=timeout, stream=True, headers=headers)
             response.raw.decode_content = True  # Handle gzip content-encoding
             
-            if response.status_code == 200:
+            if response.status_code == 200 or (headers and response.status_code == 304):
                 return response
             else:
-                print(f"  Failed with status code {response.status_code}")
+                log(f"  Failed with status code {response.status_code}")
                 response.close()
                 
         except requests.exceptions.Timeout:
-            print(f"  Timeout error on attempt {attempt}")
+            log(f"  Timeout error on attempt {attempt}")
         except requests.exceptions.ConnectionError:
-            print(f"  Connection error on attempt {attempt}")
+            log(f"  Connection error on attempt {attempt}")
         except requests.exceptions.RequestException as e:
-            print(f"  Request error on attempt {attempt}: {e}")
+            log(f"  Request error on attempt {attempt}: {e}")
         
         if attempt < max_retries:
-            print(f"  Waiting {retry_delay} seconds before retry...")
+            log(f"  Waiting {retry_delay} seconds before retry...")
             time.sleep(retry_delay)
     
-    print(f"  Failed to fetch after {max_retries} attempts")
+    log(f"  Failed to fetch after {max_retries} attempts")
     return None
 
 def extract_tvg_ids_from_playlist(url):
@@ -106,10 +126,41 @@ def extract_tvg_ids_from_playlist(url):
         return tvg_ids
     
     try:
-        for line in response.iter_lines(decode_unicode=True):
-            if line:
-                matches = re.findall(r'tvg-id="([^"]+)"', line, re.IGNORECASE)
-                tvg_ids.update(matches)
+        # Scan the raw byte stream for tvg-id="..." without splitting it into lines,
+        # only the extracted ids get decoded
+        pending = b''
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            buf = pending + chunk
+            lowered = buf.lower()
+            pos = 0
+            
+            while True:
+                start = lowered.find(b'tvg-id="', pos)
+                if start < 0:
+                    # Keep a possibly split tvg-id=" around for the next chunk
+                    pos = max(pos, len(buf) - 7)
+                    break
+                
+                match = _TVG_ID_END_RE.search(buf, start + 8)
+                if match is None:
+                    if len(buf) - start > 4096:
+                        pos = start + 8
+                        continue
+                    pos = start
+                    break
+                
+                end = match.start()
+                if match.group() != b'"':
+                    # Unterminated value, the next line may still hold a tvg-id
+                    pos = end
+                    continue
+                
+                tvg_id = buf[start + 8:end]
+                if tvg_id:
+                    tvg_ids.add(tvg_id.decode('utf-8', 'replace'))
+                pos = end + 1
+            
+            pending = buf[pos:]
         
         print(f"Extracted {len(tvg_ids)} tvg-ids from {url}")
         
@@ -147,15 +198,210 @@ def get_valid_tvg_ids(playlist_urls):
 
 def write_xml_header(f):
     """Write XML header to file"""
-    f.write('<?xml version="1.0" encoding="utf-8"?>\n')
-    f.write('<tv>\n')
+    f.write(b'<?xml version="1.0" encoding="utf-8"?>\n')
+    f.write(b'<tv>\n')
 
 def write_xml_footer(f):
     """Write XML footer to file"""
-    f.write('</tv>\n')
+    f.write(b'</tv>\n')
+
+def detect_xml_encoding(head):
+    """Return the encoding of an XML document if it is not UTF-8 compatible
+    
+    UTF-16 is recognised from its byte order mark or the null bytes around '<?',
+    any other encoding has to be declared.
+    """
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    if head.startswith(b'<\x00?\x00'):
+        return 'utf-16-le'
+    if head.startswith(b'\x00<\x00?'):
+        return 'utf-16-be'
+    
+    match = _XML_ENCODING_RE.search(head)
+    if not match:
+        return None
+    encoding = match.group(1).decode('ascii')
+    try:
+        codec = codecs.lookup(encoding).name
+    except LookupError:
+        return None
+    # A readable declaration means the bytes are ASCII compatible whatever it claims
+    if codec in ('utf-8', 'ascii') or codec.startswith(('utf-16', 'utf-32')):
+        return None
+    return encoding
+
+def find_record_close(buf, pos, close_tag):
+    """Find a record's closing tag, stepping over comments and CDATA sections
+    
+    Returns (close, next_record): the offset of the closing tag, and the offset of a
+    record start tag that comes first when the closing tag is missing. Both are -1
+    when the buffer ends before either is found.
+    """
+    while True:
+        close = buf.find(close_tag, pos)
+        match = _RECORD_OPEN_RE.search(buf, pos, close if close >= 0 else len(buf))
+        if match is None:
+            return close, -1
+        if match.group(1) is not None:
+            return -1, match.start()
+        
+        markup_end = buf.find(_MARKUP_END[match.group(2)], match.end())
+        if markup_end < 0:
+            return -1, -1
+        pos = markup_end + len(_MARKUP_END[match.group(2)])
+
+def recover_record(segment, encoding):
+    """Let lxml repair a record that is missing its closing tag"""
+    try:
+        parser = ET.XMLParser(recover=True, huge_tree=True, encoding=encoding)
+        elem = ET.fromstring(bytes(segment), parser)
+    except (LookupError, ET.XMLSyntaxError):
+        return None
+    if elem is None or elem.tag not in ('channel', 'programme'):
+        return None
+    return elem
+
+def iter_epg_records(file_obj, wanted_ids=None):
+    """Yield (tag, attrs, raw_xml) for every channel/programme by slicing the raw byte stream
+    
+    Records whose channel is not in wanted_ids are rejected on their start tag and
+    yielded with raw_xml set to None, without scanning or copying their body.
+    """
+    buf = bytearray()
+    pos = 0
+    head = bytearray()
+    encoding = None
+    codec = 'utf-8'
+    decoder = None
+    header_checked = False
+    eof = False
+    
+    # This loop runs once per record, so keep it to a handful of C-level calls
+    # on locally bound methods - no per-attribute match objects or helper calls
+    search_record = _RECORD_OPEN_RE.search
+    find_attrs = _RECORD_ATTR_RE.findall
+    find = buf.find
+    unescape = html.unescape
+    
+    while not eof:
+        chunk = file_obj.read(read_chunk_size)
+        if not chunk:
+            eof = True
+        
+        if not header_checked:
+            head += chunk
+            if len(head) < 1024 and not eof:
+                continue
+            encoding = detect_xml_encoding(head[:1024])
+            if encoding in ('utf-16', 'utf-16-le', 'utf-16-be'):
+                # Not ASCII compatible, so the whole stream is transcoded up front
+                decoder = codecs.getincrementaldecoder(encoding)('replace')
+                encoding = None
+            codec = encoding or 'utf-8'
+            chunk = bytes(head)
+            header_checked = True
+        
+        if decoder is not None:
+            chunk = decoder.decode(chunk, eof).encode('utf-8')
+        
+        if chunk:
+            del buf[:pos]
+            buf += chunk
+            pos = 0
+        
+        while True:
+            match = search_record(buf, pos)
+            if match is None:
+                # Keep a possibly split opening tag around for the next chunk
+                pos = max(pos, len(buf) - 16)
+                break
+            
+            start, attrs_start = match.span()
+            tag = match.group(1)
+            
+            if tag is None:
+                # Comment or CDATA section between records - skip it whole
+                markup_end = find(_MARKUP_END[match.group(2)], attrs_start)
+                if markup_end < 0:
+                    pos = start
+                    break
+                pos = markup_end + len(_MARKUP_END[match.group(2)])
+                continue
+            
+            tag_end = find(b'>', attrs_start - 1)
+            if tag_end < 0:
+                pos = start
+                break
+            
+            if wanted_ids and tag == b'programme':
+                # Most programmes get rejected on their channel alone, so look that
+                # up with plain finds before running the attribute regex
+                key_start = find(b' channel="', attrs_start - 1, tag_end)
+                key_end = find(b'"', key_start + 10, tag_end) if key_start >= 0 else -1
+                if key_end >= 0:
+                    tvg_id = buf[key_start + 10:key_end].decode(codec, 'replace')
+                    if '&' in tvg_id:
+                        tvg_id = unescape(tvg_id)
+                    if tvg_id not in wanted_ids:
+                        # Jump to the next record - its opening tag can't appear in this body
+                        yield 'programme', {'channel': tvg_id}, None
+                        pos = tag_end + 1
+                        continue
+            
+            attrs = {}
+            for name, value, alt_value in find_attrs(buf, attrs_start - 1, tag_end):
+                value = (value or alt_value).decode(codec, 'replace')
+                if '&' in value:
+                    value = unescape(value)
+                attrs[name.decode()] = value
+            
+            if wanted_ids and attrs.get('id' if tag == b'channel' else 'channel') not in wanted_ids:
+                yield tag.decode(), attrs, None
+                pos = tag_end + 1
+                continue
+            
+            if buf[tag_end - 1] == ord('/'):
+                end = tag_end + 1
+            else:
+                close_tag = b'</' + tag + b'>'
+                close = find(close_tag, tag_end)
+                inner = search_record(buf, tag_end, close if close >= 0 else len(buf))
+                if inner is None:
+                    next_record = -1
+                elif inner.group(1) is not None:
+                    next_record = inner.start()
+                else:
+                    # The closing tag found may sit inside a comment or CDATA section
+                    close, next_record = find_record_close(buf, tag_end, close_tag)
+                
+                if next_record < 0 and close < 0 and not eof and len(buf) - start <= max_record_size:
+                    # Record continues in the next chunk
+                    pos = start
+                    break
+                
+                if next_record >= 0 or close < 0:
+                    # Closing tag is missing - fall back to lxml for this segment only
+                    end = next_record if next_record >= 0 else len(buf)
+                    elem = recover_record(buf[start:end], encoding)
+                    if elem is not None:
+                        attrs = {name: elem.get(name) for name in ('id', 'channel', 'start', 'stop')}
+                        yield elem.tag, attrs, ET.tostring(elem, with_tail=False)
+                    pos = end
+                    continue
+                
+                end = close + len(close_tag)
+            
+            # Slicing the bytearray is the only copy a kept record gets before it is written
+            raw = buf[start:end]
+            if encoding:
+                raw = raw.decode(encoding, 'replace').encode('utf-8')
+            
+            yield tag.decode(), attrs, raw
+            pos = end
 
 def stream_parse_epg(file_obj, valid_tvg_ids, output_handle, seen_channels, seen_programmes, stats):
-    """Memory-efficient streaming XML parser"""
+    """Memory-efficient streaming XMLTV filter"""
     
     channels_added = 0
     channels_filtered = 0
@@ -167,58 +413,83 @@ def stream_parse_epg(file_obj, valid_tvg_ids, output_handle, seen_channels, seen
     
     prog_count = 0
     
+    # Work out the time window once per source rather than once per programme
+    future_cutoff, past_cutoff = get_time_cutoffs()
+    
+    # Resolve the filter configuration once per source, so a disabled filter costs
+    # a local truth test in the loop rather than a global lookup and a helper call
+    check_tvg_ids = bool(valid_tvg_ids)
+    check_dummy = bool(skip_dummy_programs)
+    check_future = future_cutoff is not None
+    check_past = past_cutoff is not None
+    
+    # With a tvg-id list every programme reaching the dummy check is on it, so the
+    # dummy ids can be picked out once instead of lowercasing each programme's tvg-id
+    dummy_ids = None
+    if check_dummy and check_tvg_ids:
+        dummy_ids = frozenset(tvg_id for tvg_id in valid_tvg_ids if is_dummy_programme(tvg_id))
+    
+    # Kept records are collected and written in batches, one write() per
+    # write_batch_size records instead of one per record
+    pending = []
+    
     try:
-        # Use iterparse for streaming - only keeps current element in memory
-        for event, elem in ET.iterparse(file_obj, events=('end',)):
+        # Slice records straight out of the byte stream - no tree is built and
+        # kept records are copied to the output instead of being re-serialized
+        for tag, attrs, raw in iter_epg_records(file_obj, valid_tvg_ids):
             
-            if elem.tag == 'channel':
-                tvg_id = elem.get('id')
+            if tag == 'channel':
+                tvg_id = attrs.get('id')
                 stats['total_channels_in_sources'] += 1
                 
-                if valid_tvg_ids and tvg_id not in valid_tvg_ids:
+                if check_tvg_ids and tvg_id not in valid_tvg_ids:
                     channels_filtered += 1
                 elif tvg_id not in seen_channels:
                     seen_channels.add(tvg_id)
-                    channel_str = ET.tostring(elem, encoding='unicode')
-                    output_handle.write('  ' + channel_str + '\n')
+                    pending += (b'  ', raw, b'\n')
                     channels_added += 1
                 
-                # Clear element from memory immediately
-                elem.clear()
-                
-            elif elem.tag == 'programme':
+            elif tag == 'programme':
                 prog_count += 1
                 if prog_count % 50000 == 0:
                     print(f"    Processed {prog_count} programmes...")
                 
-                tvg_id = elem.get('channel')
-                start_time = elem.get('start')
-                stop_time = elem.get('stop')
+                tvg_id = attrs.get('channel')
+                start_time = attrs.get('start')
+                stop_time = attrs.get('stop')
                 
                 stats['total_programmes_in_sources'] += 1
                 
                 # Apply filters
-                if valid_tvg_ids and tvg_id not in valid_tvg_ids:
+                if check_tvg_ids and tvg_id not in valid_tvg_ids:
                     programmes_filtered_tvg += 1
-                elif is_dummy_programme(tvg_id):
+                elif check_dummy and (tvg_id in dummy_ids if dummy_ids is not None else is_dummy_programme(tvg_id)):
                     programmes_skipped_dummy += 1
-                elif is_programme_too_far_future(start_time, days_future):
+                elif check_future and is_programme_too_far_future(start_time, future_cutoff):
                     programmes_skipped_future += 1
-                elif is_programme_too_far_past(stop_time, days_past):
+                elif check_past and is_programme_too_far_past(stop_time, past_cutoff):
                     programmes_skipped_past += 1
                 else:
-                    prog_key = f"{tvg_id}_{start_time}_{stop_time}"
+                    # 64-bit digest instead of the full string keeps the dedup set small. The
+                    # f-string is a single allocation and measured cheaper than joining or
+                    # hashing the fields separately; tuple keys would put Python objects back in the set
+                    prog_key = xxhash.xxh3_64_intdigest(f"{tvg_id}|{start_time}|{stop_time}".encode())
                     if prog_key not in seen_programmes:
                         seen_programmes.add(prog_key)
-                        programme_str = ET.tostring(elem, encoding='unicode')
-                        output_handle.write('  ' + programme_str + '\n')
+                        pending += (b'  ', raw, b'\n')
                         programmes_added += 1
-                
-                # Clear element from memory immediately
-                elem.clear()
-    
-    except ET.ParseError as e:
-        print(f"  XML parsing error (continuing): {e}")
+                        
+                        # Three parts per record
+                        if len(pending) >= write_batch_size * 3:
+                            output_handle.write(b''.join(pending))
+                            pending.clear()
+    
+    except (EOFError, OSError, isal_zlib.error) as e:
+        print(f"  Stream error (continuing): {e}")
+    finally:
+        # Records already counted as seen must make it to the output
+        if pending:
+            output_handle.write(b''.join(pending))
     
     # Update stats
     stats['channels_filtered_by_tvg_id'] += channels_filtered
@@ -239,39 +510,145 @@ def stream_parse_epg(file_obj, valid_tvg_ids, output_handle, seen_channels, seen
     if programmes_skipped_past > 0:
         print(f"  Skipped {programmes_skipped_past} programmes older than {days_past} days")
 
-def process_epg_source(url, valid_tvg_ids, output_handle, seen_channels, seen_programmes, stats):
-    """Process a single EPG source with streaming"""
-    print(f"Processing {url}...")
+def cache_file_for(url):
+    """Path of the cached copy of an EPG source, its metadata lives next to it with a .json suffix"""
+    return os.path.join(cache_dir, xxhash.xxh3_64_hexdigest(url.encode()))
+
+def prune_cache(epg_urls):
+    """Delete cached sources (and leftover temporary files) that don't belong to any of epg_urls"""
+    if not os.path.isdir(cache_dir):
+        return
     
-    response = fetch_with_retry(url, timeout=60)
+    keep = set()
+    for url in epg_urls:
+        cache_file = os.path.basename(cache_file_for(url))
+        keep.update((cache_file, cache_file + '.json'))
+    
+    for name in os.listdir(cache_dir):
+        if name not in keep:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+                print(f"Removed stale cache file {name}")
+            except OSError as e:
+                print(f"Could not remove stale cache file {name}: {e}")
+
+def fetch_epg_source(url, log=print):
+    """Download an EPG source into the cache, reusing the cached copy if it is unchanged
+    
+    If the download fails, the copy from an earlier run is used when there is one.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = cache_file_for(url)
+    meta_file = cache_file + '.json'
+    
+    # Revalidate the cached copy with the validators the server sent last time
+    headers = {}
+    if os.path.exists(cache_file) and os.path.exists(meta_file):
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        except (OSError, ValueError) as e:
+            log(f"  Ignoring cache metadata for {url}: {e}")
+    
+    response = fetch_with_retry(url, timeout=60, headers=headers, log=log)
     if response is None:
+        if os.path.exists(cache_file):
+            log(f"  Download failed, using cached copy of {url}")
+            return open(cache_file, 'rb')
+        return None
+    
+    try:
+        if response.status_code == 304:
+            log(f"  {url} not modified, using cached copy")
+            return open(cache_file, 'rb')
+        
+        # Write to a temporary file first so an interrupted download never replaces a good copy
+        with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+            try:
+                shutil.copyfileobj(response.raw, f, read_chunk_size)
+            except Exception as e:
+                f.close()
+                os.remove(f.name)
+                if not os.path.exists(cache_file):
+                    raise
+                log(f"  Download error: {e}, using cached copy of {url}")
+                return open(cache_file, 'rb')
+        os.replace(f.name, cache_file)
+        
+        meta = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        }
+        with open(meta_file, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        
+        return open(cache_file, 'rb')
+    finally:
+        # Always close the response to free up the connection
+        response.close()
+
+def download_epg_source(url):
+    """Download an EPG source in a worker thread
+    
+    Returns (source, log_lines): the opened file or None, and the download messages,
+    which are printed when the source is processed so they don't interleave with
+    the output of other sources.
+    """
+    log_lines = []
+    try:
+        source = fetch_epg_source(url, log_lines.append)
+    except Exception as e:
+        log_lines.append(f"  Download error: {e}")
+        source = None
+    return source, log_lines
+
+def close_downloads(downloads):
+    """Close the files of finished downloads, whether or not they were processed"""
+    for download in downloads:
+        if download.done() and not download.cancelled():
+            source, _ = download.result()
+            if source is not None:
+                source.close()
+
+def process_epg_source(url, download, valid_tvg_ids, output_handle, seen_channels, seen_programmes, stats):
+    """Process a single downloaded EPG source with streaming"""
+    print(f"Processing {url}...")
+    
+    source, log_lines = download.result()
+    for line in log_lines:
+        print(line)
+    
+    if source is None:
         print(f"Skipping {url} due to fetch failure")
         return
     
     try:
         if url.endswith('.gz'):
             print(f"  Streaming and decompressing...")
-            # Stream decompress directly from response - NEVER loads full file into memory
-            decompressor = gzip.GzipFile(fileobj=response.raw)
+            # Stream decompress from the downloaded file - NEVER loads full file into memory
+            decompressor = igzip.IGzipFile(fileobj=source)
             stream_parse_epg(decompressor, valid_tvg_ids, output_handle, seen_channels, seen_programmes, stats)
         else:
             print(f"  Streaming XML...")
-            # Stream directly from response
-            stream_parse_epg(response.raw, valid_tvg_ids, output_handle, seen_channels, seen_programmes, stats)
+            stream_parse_epg(source, valid_tvg_ids, output_handle, seen_channels, seen_programmes, stats)
         
     except Exception as e:
         print(f"Failed to process XML from {url}: {e}")
         import traceback
         traceback.print_exc()
     finally:
-        # Always close the response to free up the connection
-        response.close()
+        source.close()
 
 def filter_and_build_epg(epg_urls, playlist_urls=None):
     valid_tvg_ids = get_valid_tvg_ids(playlist_urls or [])
     
     seen_channels = set()
-    seen_programmes = set()
+    seen_programmes = set()  # xxh3 digests of (channel, start, stop)
     
     stats = {
         'total_channels_in_sources': 0,
@@ -295,13 +672,28 @@ def filter_and_build_epg(epg_urls, playlist_urls=None):
     if filters:
         print(f"Filtering: {', '.join(filters)}\n")
     
-    with gzip.open(output_file_gz, 'wt', encoding='utf-8') as f:
-        write_xml_header(f)
-        
-        for url in epg_urls:
-            process_epg_source(url, valid_tvg_ids, f, seen_channels, seen_programmes, stats)
+    # Drop cached copies of sources that were removed from epg_urls
+    prune_cache(epg_urls)
+    
+    # Downloads run ahead in worker threads while sources are parsed in order on
+    # the main thread, which owns the dedup sets and the output file
+    # The published file is fetched by players every few hours, so it gets the
+    # smallest output: zlib level 9 costs well under a second on a full run and
+    # stream_parse_epg already batches its writes
+    with ThreadPoolExecutor(max_workers=download_workers) as executor, gzip.open(output_file_gz, 'wb', compresslevel=9) as f:
+        downloads = [executor.submit(download_epg_source, url) for url in epg_urls]
         
-        write_xml_footer(f)
+        try:
+            write_xml_header(f)
+            
+            for url, download in zip(epg_urls, downloads):
+                process_epg_source(url, download, valid_tvg_ids, f, seen_channels, seen_programmes, stats)
+            
+            write_xml_footer(f)
+        finally:
+            # If the loop aborted, drop queued downloads and close files nobody will parse
+            executor.shutdown(cancel_futures=True)
+            close_downloads(downloads)
     
     print(f"\nCompressed EPG saved to {output_file_gz}")
     print(f"Total: {len(seen_channels)} unique channels, {len(seen_programmes)} unique programmes")
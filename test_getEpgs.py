@@ -0,0 +1,174 @@
+import io
+import os
+import codecs
+import contextlib
+import gzip
+
+import lxml.etree as ET
+import pytest
+
+import getEpgs
+
+CHUNK_SIZES = [7, 64, 1024 * 1024]
+
+def run_stream_parse(xml_bytes, valid_tvg_ids=(), decompress=False):
+    """Run stream_parse_epg over an in-memory source, return (parsed output, stats)"""
+    stats = {
+        'total_channels_in_sources': 0,
+        'total_programmes_in_sources': 0,
+        'channels_filtered_by_tvg_id': 0,
+        'programmes_filtered_by_tvg_id': 0,
+        'programmes_filtered_by_future': 0,
+        'programmes_filtered_by_past': 0,
+        'programmes_filtered_by_dummy': 0
+    }
+    output = io.BytesIO()
+    with contextlib.redirect_stdout(io.StringIO()):
+        source = io.BytesIO(xml_bytes)
+        if decompress:
+            source = getEpgs.igzip.IGzipFile(fileobj=source)
+        getEpgs.stream_parse_epg(source, set(valid_tvg_ids), output, set(), set(), stats)
+    # Must be well-formed once wrapped the same way filter_and_build_epg does
+    root = ET.fromstring(b'<tv>\n' + output.getvalue() + b'</tv>\n')
+    return root, stats
+
+@pytest.fixture(autouse=True)
+def no_time_filters(monkeypatch):
+    monkeypatch.setattr(getEpgs, 'days_future', 0)
+    monkeypatch.setattr(getEpgs, 'days_past', 0)
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_cdata_containing_closing_tag(monkeypatch, chunk_size):
+    monkeypatch.setattr(getEpgs, 'read_chunk_size', chunk_size)
+    xml = (b'<?xml version="1.0" encoding="UTF-8"?>\n<tv>\n'
+           b'  <programme channel="a.us" start="20260101000000 +0000" stop="20260101010000 +0000">\n'
+           b'    <title>One</title>\n'
+           b'    <desc><![CDATA[see </programme> here]]></desc>\n'
+           b'  </programme>\n'
+           b'  <programme channel="a.us" start="20260101010000 +0000" stop="20260101020000 +0000">\n'
+           b'    <title>Two</title>\n'
+           b'  </programme>\n'
+           b'</tv>\n')
+    root, stats = run_stream_parse(xml)
+
+    assert stats['total_programmes_in_sources'] == 2
+    assert [p.findtext('title') for p in root] == ['One', 'Two']
+    assert root[0].findtext('desc') == 'see </programme> here'
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_commented_out_records_are_ignored(monkeypatch, chunk_size):
+    monkeypatch.setattr(getEpgs, 'read_chunk_size', chunk_size)
+    xml = (b'<?xml version="1.0" encoding="UTF-8"?>\n<tv>\n'
+           b'  <!-- <channel id="b.us"> -->\n'
+           b'  <channel id="a.us"><display-name>A</display-name></channel>\n'
+           b'  <!-- <programme channel="a.us"> -->\n'
+           b'  <programme channel="a.us" start="20260101000000 +0000" stop="20260101010000 +0000">\n'
+           b'    <!-- </programme> -->\n'
+           b'    <title>One</title>\n'
+           b'  </programme>\n'
+           b'</tv>\n')
+    root, stats = run_stream_parse(xml)
+
+    assert stats['total_channels_in_sources'] == 1
+    assert stats['total_programmes_in_sources'] == 1
+    assert [e.tag for e in root] == ['channel', 'programme']
+    assert root[1].findtext('title') == 'One'
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+@pytest.mark.parametrize('encoding', ['utf-16', 'utf-16-le', 'utf-16-be'])
+def test_utf16_source(monkeypatch, chunk_size, encoding):
+    monkeypatch.setattr(getEpgs, 'read_chunk_size', chunk_size)
+    xml = ('<?xml version="1.0" encoding="UTF-16"?>\n<tv>\n'
+           '  <channel id="a.us"><display-name>Ä</display-name></channel>\n'
+           '  <programme channel="a.us" start="20260101000000 +0000" stop="20260101010000 +0000">\n'
+           '    <title>Café</title>\n'
+           '  </programme>\n'
+           '  <programme channel="b.us" start="20260101000000 +0000" stop="20260101010000 +0000">\n'
+           '    <title>Other</title>\n'
+           '  </programme>\n'
+           '</tv>\n').encode(encoding)
+    root, stats = run_stream_parse(xml, valid_tvg_ids={'a.us'})
+
+    assert stats['total_programmes_in_sources'] == 2
+    assert stats['programmes_filtered_by_tvg_id'] == 1
+    assert root[0].findtext('display-name') == 'Ä'
+    assert root[1].findtext('title') == 'Café'
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_corrupt_gzip_source(monkeypatch, chunk_size):
+    monkeypatch.setattr(getEpgs, 'read_chunk_size', chunk_size)
+    head = b'<?xml version="1.0" encoding="UTF-8"?>\n<tv>\n' + b''.join(
+        b'  <programme channel="%s" start="20260101%06d +0000" stop="20260101%06d +0000"><title>T</title></programme>\n'
+        % (channel, i, i + 1) for i in range(1000) for channel in (b'a.us', b'b.us'))
+    # A second gzip member with a broken deflate block after a large intact one
+    broken = bytearray(gzip.compress(b'</tv>\n'))
+    broken[10] ^= 0xff
+    root, stats = run_stream_parse(gzip.compress(head) + bytes(broken), valid_tvg_ids={'a.us'}, decompress=True)
+
+    # The error is handled inside stream_parse_epg, so the stats still match the output
+    assert stats['total_programmes_in_sources'] == len(root) + stats['programmes_filtered_by_tvg_id']
+    if chunk_size < 1024 * 1024:
+        assert len(root) > 0
+
+def test_detect_xml_encoding():
+    assert getEpgs.detect_xml_encoding(b'<?xml version="1.0" encoding="UTF-8"?><tv>') is None
+    assert getEpgs.detect_xml_encoding(b'<?xml version="1.0" encoding="ISO-8859-1"?><tv>') == 'ISO-8859-1'
+    assert getEpgs.detect_xml_encoding(codecs.BOM_UTF16_LE + '<?xml?>'.encode('utf-16-le')) == 'utf-16'
+    assert getEpgs.detect_xml_encoding('<?xml?>'.encode('utf-16-be')) == 'utf-16-be'
+
+class FakeResponse:
+    """Stands in for a streamed requests response, serving fixed size chunks"""
+    def __init__(self, body, chunk_size):
+        self.body = body
+        self.chunk_size = chunk_size
+
+    def iter_content(self, chunk_size=None):
+        for i in range(0, len(self.body), self.chunk_size):
+            yield self.body[i:i + self.chunk_size]
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 8, 9, 64, 65536])
+@pytest.mark.parametrize('newline', [b'\n', b'\r\n', b'\r'])
+def test_playlist_tvg_ids(monkeypatch, chunk_size, newline):
+    playlist = newline.join([
+        b'#EXTM3U',
+        b'#EXTINF:-1 tvg-id="a.us" tvg-name="A",A',
+        b'http://example.com/a',
+        b'#EXTINF:-1 tvg-id="broken',
+        b'#EXTINF:-1 TVG-ID="after.broken" tvg-name="B",B',
+        b'http://example.com/b',
+        b'#EXTINF:-1 tvg-id="" tvg-name="C",C',
+        b'#EXTINF:-1 tvg-id="caf\xc3\xa9.fr",D',
+        b'#EXTINF:-1 tvg-id="',
+    ])
+    monkeypatch.setattr(getEpgs, 'fetch_with_retry', lambda url: FakeResponse(playlist, chunk_size))
+    with contextlib.redirect_stdout(io.StringIO()):
+        tvg_ids = getEpgs.extract_tvg_ids_from_playlist('http://example.com/playlist.m3u')
+
+    assert tvg_ids == {'a.us', 'after.broken', 'café.fr'}
+
+def test_fetch_falls_back_to_cached_copy(monkeypatch, tmp_path):
+    monkeypatch.setattr(getEpgs, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(getEpgs, 'fetch_with_retry', lambda *args, **kwargs: None)
+    url = 'http://example.com/epg.xml.gz'
+    log_lines = []
+
+    assert getEpgs.fetch_epg_source(url, log_lines.append) is None
+
+    with open(getEpgs.cache_file_for(url), 'wb') as f:
+        f.write(b'cached')
+    with getEpgs.fetch_epg_source(url, log_lines.append) as source:
+        assert source.read() == b'cached'
+    assert log_lines == [f"  Download failed, using cached copy of {url}"]
+
+def test_prune_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(getEpgs, 'cache_dir', str(tmp_path))
+    kept = getEpgs.cache_file_for('http://example.com/kept.xml.gz')
+    dropped = getEpgs.cache_file_for('http://example.com/dropped.xml.gz')
+    for path in (kept, kept + '.json', dropped, dropped + '.json', str(tmp_path / 'tmpabc123')):
+        with open(path, 'wb'):
+            pass
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        getEpgs.prune_cache(['http://example.com/kept.xml.gz'])
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted([os.path.basename(kept), os.path.basename(kept) + '.json'])